@@ -1,19 +1,131 @@
 import os
+import asyncio
 import asyncpg
-from fastapi import FastAPI, HTTPException
+from fastapi import Body, FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 from decimal import Decimal, ROUND_HALF_UP
-from typing import List, Dict
+from typing import Annotated, List, Dict
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from urllib.parse import urlparse
 
 app = FastAPI(title="Expense Splitter API")
 db_pool = None
+# Dedicated connection LISTENing for expenses changes made by any worker or client
+db_listener = None
+
+# Bumped whenever the expenses table changes: directly by this worker's write
+# handlers, and via NOTIFY from the expenses trigger for everyone else's writes
+db_version = 0
+balances_cache = (None, None)
+CENT = Decimal("0.01")
+
+# Connections held by each worker process. Assumes a single uvicorn worker by
+# default; with N workers set this to ceil(expected concurrency / N) and keep
+# N * DB_POOL_SIZE below the server's max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+
+# created_at is TIMESTAMP without time zone, so every session writes it as UTC: both
+# the app-side timestamps and the column's CURRENT_TIMESTAMP default
+DB_SERVER_SETTINGS = {"timezone": "UTC"}
+
+# Largest batch POST /expenses/bulk accepts, keeping one executemany well inside command_timeout
+MAX_BULK_EXPENSES = 500
+
+# Rows pulled from the expenses cursor per round-trip when streaming
+EXPENSES_PREFETCH = 1000
+# A streamed listing holds a pooled connection until the client has read the whole
+# body, so only half the pool may stream at once; the rest stays free for other endpoints
+EXPENSES_STREAM_LIMIT = max(1, DB_POOL_SIZE // 2)
+EXPENSES_STREAM_WAIT = 10
+expenses_stream_slots = asyncio.Semaphore(EXPENSES_STREAM_LIMIT)
+
+# SQL used by the endpoints, prepared once per pooled connection
+STATEMENTS = {
+    "insert_expense_at": "INSERT INTO expenses (id, amount, description, paid_by, created_at) VALUES ($1, $2, $3, $4, $5)",
+    "select_expenses_json": (
+        "SELECT row_to_json(e)::text FROM "
+        "(SELECT id, amount::float8 AS amount, description, paid_by, created_at FROM expenses) e "
+        "ORDER BY e.created_at DESC"
+    ),
+    "update_expense": "UPDATE expenses SET amount = $1, description = $2, paid_by = $3 WHERE id = $4 RETURNING *",
+    "delete_expense": "DELETE FROM expenses WHERE id = $1 RETURNING id",
+    "select_balances": "SELECT paid_by, (COALESCE(SUM(amount), 0) * 100)::bigint AS total_cents FROM expenses GROUP BY paid_by",
+    "select_people": "SELECT paid_by FROM expenses GROUP BY paid_by",
+}
+
+class ExpenseConnection(asyncpg.Connection):
+    __slots__ = ("_stmts",)
+
+async def create_schema(conn):
+    print("Creating expenses table if not exists...")
+    async with conn.transaction():
+        # Serialize schema setup across workers starting at the same time
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('expenses_schema'))")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS expenses (
+                id TEXT PRIMARY KEY,
+                amount DECIMAL(10,2),
+                description TEXT NOT NULL,
+                paid_by TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS expenses_paid_by_idx
+                ON expenses (paid_by) INCLUDE (amount);
+            CREATE INDEX IF NOT EXISTS expenses_created_at_idx
+                ON expenses (created_at DESC);
+        """)
+        # Announce committed changes to expenses so every worker can drop its cached balances.
+        # Row-level, so UPDATE/DELETE statements that match nothing stay silent; Postgres
+        # folds repeated notifications within one transaction into one.
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION notify_expenses_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('expenses_changed', '');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_trigger
+                    WHERE tgrelid = 'expenses'::regclass AND tgname = 'expenses_notify_rows'
+                ) THEN
+                    CREATE TRIGGER expenses_notify_rows
+                        AFTER INSERT OR UPDATE OR DELETE ON expenses
+                        FOR EACH ROW EXECUTE FUNCTION notify_expenses_changed();
+                END IF;
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_trigger
+                    WHERE tgrelid = 'expenses'::regclass AND tgname = 'expenses_notify_truncate'
+                ) THEN
+                    CREATE TRIGGER expenses_notify_truncate
+                        AFTER TRUNCATE ON expenses
+                        FOR EACH STATEMENT EXECUTE FUNCTION notify_expenses_changed();
+                END IF;
+            END;
+            $$;
+        """)
+    print("Expenses table created or already exists")
+
+def utc_now():
+    # Naive UTC, matching the TIMESTAMP column and the UTC session time zone
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def bump_db_version(*args):
+    # Also used as the LISTEN callback and the listener's termination callback
+    global db_version
+    db_version += 1
+
+async def prepare_statements(conn):
+    conn._stmts = {name: await conn.prepare(sql) for name, sql in STATEMENTS.items()}
 
 async def init_db():
-    global db_pool
+    global db_pool, db_listener
     print("Reading DATABASE_PUBLIC_URL from environment...")
     db_url = os.getenv("DATABASE_PUBLIC_URL")
     if not db_url:
@@ -45,13 +157,39 @@ async def init_db():
 
     print(f"Connecting to {db_host}:{db_port} with user {db_user}...")
     try:
+        # The schema must exist before the pool prepares statements against it.
+        # The same connection then stays open to receive change notifications.
+        db_listener = await asyncpg.connect(
+            user=db_user,
+            password=db_password,
+            database=db_name,
+            host=db_host,
+            port=db_port,
+            server_settings=DB_SERVER_SETTINGS
+        )
+        try:
+            await create_schema(db_listener)
+            await db_listener.add_listener("expenses_changed", bump_db_version)
+            db_listener.add_termination_listener(bump_db_version)
+        except Exception:
+            await db_listener.close()
+            raise
+
         db_pool = await asyncpg.create_pool(
             user=db_user,
             password=db_password,
             database=db_name,
             host=db_host,
             port=db_port,
-            command_timeout=10
+            command_timeout=10,
+            server_settings=DB_SERVER_SETTINGS,
+            min_size=DB_POOL_SIZE,
+            max_size=DB_POOL_SIZE,
+            # Never close idle connections: a reconnect would also repeat init's PREPAREs
+            max_inactive_connection_lifetime=0,
+            statement_cache_size=1024,
+            connection_class=ExpenseConnection,
+            init=prepare_statements
         )
         print("Connected to database successfully")
     except Exception as e:
@@ -62,23 +200,12 @@ async def init_db():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
-    async with db_pool.acquire() as conn:
-        print("Creating expenses table if not exists...")
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS expenses (
-                id TEXT PRIMARY KEY,
-                amount DECIMAL(10,2),
-                description TEXT NOT NULL,
-                paid_by TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        print("Expenses table created or already exists")
     yield
     print("Closing database pool...")
     await db_pool.close()
+    await db_listener.close()
 
-app = FastAPI(title="Expense Splitter API", lifespan=lifespan)
+app = FastAPI(title="Expense Splitter API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 class ExpenseCreate(BaseModel):
     amount: float
@@ -89,7 +216,7 @@ class ExpenseCreate(BaseModel):
     def validate_amount(cls, v):
         if v <= 0:
             raise ValueError("Amount must be positive")
-        return Decimal(str(v)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        return Decimal(str(v)).quantize(CENT, rounding=ROUND_HALF_UP)
 
     @field_validator("description")
     def validate_description(cls, v):
@@ -110,6 +237,70 @@ class ExpenseOut(BaseModel):
     paid_by: str
     created_at: datetime
 
+class SettlementOut(BaseModel):
+    from_: str = Field(alias="from")
+    to: str
+    amount: float
+
+class SettlementsOut(BaseModel):
+    settlements: List[SettlementOut]
+
+async def calculate_balances(conn) -> Dict[str, float]:
+    # Let Postgres do the per-person sums so only one row per payer crosses the wire
+    rows = await conn._stmts["select_balances"].fetch()
+    if not rows:
+        return {}
+
+    # Sums arrive as integer cents, so no Decimal objects are built per row
+    totals = {row["paid_by"]: row["total_cents"] for row in rows}
+    fair_share = sum(totals.values()) / len(totals)
+    return {person: (total - fair_share) / 100 for person, total in totals.items()}
+
+async def load_balances() -> Dict[str, float]:
+    async with db_pool.acquire() as conn:
+        return await calculate_balances(conn)
+
+async def get_cached_balances() -> Dict[str, float]:
+    global balances_cache
+    version, task = balances_cache
+    failed = task is not None and task.done() and (task.cancelled() or task.exception() is not None)
+    # Without a live listener other workers' writes go unseen, so stop trusting the cache
+    listening = db_listener is not None and not db_listener.is_closed()
+    if task is None or version != db_version or failed or not listening:
+        # Tagged with the version at start, so a write that lands mid-query invalidates the result.
+        # Concurrent callers for the same version await this one task instead of querying again.
+        task = asyncio.create_task(load_balances())
+        balances_cache = (db_version, task)
+    # Shield so a cancelled request doesn't cancel the load other callers are waiting on
+    return await asyncio.shield(task)
+
+def calculate_settlements(balances: Dict[str, float]) -> List[Dict]:
+    # Work in integer cents so the greedy matching is exact
+    balances_cents = {person: round(balance * 100) for person, balance in balances.items()}
+    debtors = [person for person, cents in balances_cents.items() if cents < 0]
+    debts = [-balances_cents[person] for person in debtors]
+    creditors = [person for person, cents in balances_cents.items() if cents > 0]
+    credits = [balances_cents[person] for person in creditors]
+
+    settlements = []
+    i, j = 0, 0
+    while i < len(debts) and j < len(credits):
+        debt, credit = debts[i], credits[j]
+        amount = debt if debt < credit else credit
+        settlements.append({
+            "from": debtors[i],
+            "to": creditors[j],
+            "amount": amount / 100
+        })
+    
+        debts[i] = debt - amount
+        credits[j] = credit - amount
+        # Advance whichever side (or both) was just settled, without branching
+        i += debt == amount
+        j += credit == amount
+
+    return settlements
+
 @app.get("/test-db")
 async def test_db():
     try:
@@ -122,119 +313,139 @@ async def test_db():
 @app.post("/expenses", response_model=ExpenseOut)
 async def create_expense(expense: ExpenseCreate):
     expense_id = str(uuid.uuid4())
+    created_at = utc_now()
     async with db_pool.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO expenses (id, amount, description, paid_by) VALUES ($1, $2, $3, $4)",
-            expense_id, float(expense.amount), expense.description, expense.paid_by
+        await conn._stmts["insert_expense_at"].fetch(
+            expense_id, expense.amount, expense.description, expense.paid_by, created_at
         )
-    return {**expense.dict(), "id": expense_id, "created_at": datetime.utcnow()}
+    bump_db_version()
+    return {**expense.model_dump(), "id": expense_id, "created_at": created_at}
+
+@app.post("/expenses/bulk", response_model=List[ExpenseOut])
+async def create_expenses_bulk(
+    expenses: Annotated[List[ExpenseCreate], Body(min_length=1, max_length=MAX_BULK_EXPENSES)]
+):
+    # One timestamp for the batch so the response matches what is stored without reading it back
+    created_at = utc_now()
+    rows = [
+        (str(uuid.uuid4()), expense.amount, expense.description, expense.paid_by, created_at)
+        for expense in expenses
+    ]
+    # executemany is atomic on its own, so the batch is stored entirely or not at all
+    async with db_pool.acquire() as conn:
+        await conn._stmts["insert_expense_at"].executemany(rows)
+    bump_db_version()
+    return [
+        {"id": row[0], "amount": row[1], "description": row[2], "paid_by": row[3], "created_at": row[4]}
+        for row in rows
+    ]
+
+# The pooled connection, read transaction and stream slot behind one listing
+class ExpensesStream:
+    def __init__(self, conn):
+        self.conn = conn
+        self.transaction = None
+        self.released = False
+
+    async def release(self):
+        if self.released:
+            return
+        self.released = True
+        try:
+            try:
+                if self.transaction is not None:
+                    await self.transaction.rollback()
+            finally:
+                await db_pool.release(self.conn)
+        finally:
+            expenses_stream_slots.release()
+
+# Starlette can cancel the send before the body generator is ever entered (e.g. the
+# client disconnects first), so cleanup runs here once the response is over, not in the generator
+class ExpensesStreamResponse(StreamingResponse):
+    def __init__(self, content, on_close):
+        super().__init__(content, media_type="application/json")
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                await self.on_close()
+
+async def stream_expenses(cursor, rows):
+    # Postgres renders each row as JSON; we only stitch batches into one array
+    yield "["
+    separator = ""
+    while rows:
+        yield separator + ",".join(row[0] for row in rows)
+        separator = ","
+        rows = await cursor.fetch(EXPENSES_PREFETCH)
+    yield "]"
 
 @app.get("/expenses", response_model=List[ExpenseOut])
 async def get_expenses():
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM expenses ORDER BY created_at DESC")
-    return [dict(row) for row in rows]
+    try:
+        await asyncio.wait_for(expenses_stream_slots.acquire(), timeout=EXPENSES_STREAM_WAIT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Too many expense listings in progress")
+
+    # Open the cursor and fetch the first batch before any headers go out,
+    # so database failures still surface as a 500 instead of a truncated 200
+    try:
+        conn = await db_pool.acquire(timeout=EXPENSES_STREAM_WAIT)
+    except BaseException:
+        expenses_stream_slots.release()
+        raise
+    stream = ExpensesStream(conn)
+    try:
+        transaction = conn.transaction()
+        await transaction.start()
+        stream.transaction = transaction
+        cursor = await conn._stmts["select_expenses_json"].cursor()
+        rows = await cursor.fetch(EXPENSES_PREFETCH)
+    except BaseException:
+        await stream.release()
+        raise
+    # Returning a Response skips response_model validation (it still documents the schema)
+    return ExpensesStreamResponse(stream_expenses(cursor, rows), stream.release)
 
 @app.put("/expenses/{expense_id}", response_model=ExpenseOut)
 async def update_expense(expense_id: str, expense: ExpenseCreate):
     async with db_pool.acquire() as conn:
-        result = await conn.fetchrow(
-            "UPDATE expenses SET amount = $1, description = $2, paid_by = $3 WHERE id = $4 RETURNING *",
-            float(expense.amount), expense.description, expense.paid_by, expense_id
+        result = await conn._stmts["update_expense"].fetchrow(
+            expense.amount, expense.description, expense.paid_by, expense_id
         )
         if not result:
             raise HTTPException(status_code=404, detail="Expense not found")
+    bump_db_version()
     return dict(result)
 
 @app.delete("/expenses/{expense_id}")
 async def delete_expense(expense_id: str):
     async with db_pool.acquire() as conn:
-        result = await conn.execute("DELETE FROM expenses WHERE id = $1", expense_id)
-        if result == "DELETE 0":
+        deleted_id = await conn._stmts["delete_expense"].fetchval(expense_id)
+        if deleted_id is None:
             raise HTTPException(status_code=404, detail="Expense not found")
+    bump_db_version()
     return {"message": "Expense deleted"}
 
-@app.get("/settlements")
+@app.get("/settlements", response_model=SettlementsOut)
 async def get_settlements():
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM expenses")
-    
-    if not rows:
-        return {"settlements": []}
-
-    total_amount = sum(float(row["amount"]) for row in rows)
-    num_people = len(set(row["paid_by"] for row in rows))
-    if num_people == 0:
-        return {"settlements": []}
-    
-    fair_share = total_amount / num_people
-    balances = {}
-    for row in rows:
-        person = row["paid_by"]
-        amount = float(row["amount"])
-        balances[person] = balances.get(person, 0) + amount
-    
-    for person in balances:
-        balances[person] = balances[person] - fair_share
-    
-    settlements = []
-    debtors = [(person, balance) for person, balance in balances.items() if balance < 0]
-    creditors = [(person, balance) for person, balance in balances.items() if balance > 0]
-    
-    i, j = 0, 0
-    while i < len(debtors) and j < len(creditors):
-        debtor, debt = debtors[i]
-        creditor, credit = creditors[j]
-        debt, credit = abs(debt), abs(credit)
-        
-        amount = min(debt, credit)
-        if amount > 0:
-            settlements.append({
-                "from": debtor,
-                "to": creditor,
-                "amount": round(amount, 2)
-            })
-        
-        debt -= amount
-        credit -= amount
-        
-        if debt <= 0.01:
-            i += 1
-        if credit <= 0.01:
-            j += 1
-        
-        debtors[i] = (debtor, -debt) if i < len(debtors) else None
-        creditors[j] = (creditor, credit) if j < len(creditors) else None
-    
-    return {"settlements": settlements}
+    balances = await get_cached_balances()
+    return {"settlements": calculate_settlements(balances)}
 
 @app.get("/balances", response_model=Dict[str, float])
 async def get_balances():
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM expenses")
-    
-    if not rows:
-        return {}
-    
-    total_amount = sum(float(row["amount"]) for row in rows)
-    num_people = len(set(row["paid_by"] for row in rows))
-    if num_people == 0:
-        return {}
-    
-    fair_share = total_amount / num_people
-    balances = {}
-    for row in rows:
-        person = row["paid_by"]
-        amount = float(row["amount"])
-        balances[person] = balances.get(person, 0) + amount
-    
-    for person in balances:
-        balances[person] = round(balances[person] - fair_share, 2)
+    balances = await get_cached_balances()
     
-    return balances
+    return {person: round(balance, 2) for person, balance in balances.items()}
 
 @app.get("/people", response_model=List[str])
 async def get_people():
     async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT DISTINCT paid_by FROM expenses")
+        rows = await conn._stmts["select_people"].fetch()
     return [row["paid_by"] for row in rows]
\ No newline at end of file
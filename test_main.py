@@ -0,0 +1,75 @@
+import asyncio
+
+from main import ExpensesStreamResponse, calculate_balances, calculate_settlements
+
+
+class StubStatement:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetch(self):
+        return self.rows
+
+
+class StubConnection:
+    def __init__(self, totals_cents):
+        rows = [{"paid_by": person, "total_cents": cents} for person, cents in totals_cents.items()]
+        self._stmts = {"select_balances": StubStatement(rows)}
+
+
+def settle(totals_cents):
+    balances = asyncio.run(calculate_balances(StubConnection(totals_cents)))
+    return calculate_settlements(balances)
+
+
+def test_uneven_three_way_split_with_leftover_credit():
+    # 10.00 split three ways: debts round to 3.33 + 3.33, the credit to 6.67
+    assert settle({"alice": 1000, "bob": 0, "carol": 0}) == [
+        {"from": "bob", "to": "alice", "amount": 3.33},
+        {"from": "carol", "to": "alice", "amount": 3.33},
+    ]
+
+
+def test_uneven_three_way_split_with_leftover_debt():
+    # 10.00 split three ways the other way round: the debt rounds to 3.33, credits to 1.67 each
+    assert settle({"alice": 0, "bob": 500, "carol": 500}) == [
+        {"from": "alice", "to": "bob", "amount": 1.67},
+        {"from": "alice", "to": "carol", "amount": 1.66},
+    ]
+
+
+def test_one_debtor_many_creditors():
+    # 160.00 over four people: alice owes 40.00, bob is even, carol and dave are owed
+    assert settle({"alice": 0, "bob": 4000, "carol": 5000, "dave": 7000}) == [
+        {"from": "alice", "to": "carol", "amount": 10.0},
+        {"from": "alice", "to": "dave", "amount": 30.0},
+    ]
+
+
+def test_all_balances_zero():
+    assert settle({"alice": 1250, "bob": 1250, "carol": 1250}) == []
+
+
+def test_no_expenses():
+    assert settle({}) == []
+
+
+def test_expenses_stream_cleanup_runs_on_early_disconnect():
+    closed = []
+
+    async def body():
+        yield "[]"
+
+    async def on_close():
+        closed.append(True)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    response = ExpensesStreamResponse(body(), on_close)
+    asyncio.run(response({"type": "http"}, receive, send))
+
+    assert closed == [True]